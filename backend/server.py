@@ -1,16 +1,27 @@
 from fastapi import FastAPI, APIRouter, File, UploadFile, HTTPException
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.middleware.gzip import GZipMiddleware
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from bson import ObjectId
+from bson.errors import InvalidId
+from gridfs.errors import NoFile
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from contextlib import asynccontextmanager
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from typing import Any, AsyncIterator, Callable, List, Optional, Tuple
 import uuid
 from datetime import datetime
 import base64
+import binascii
 import asyncio
+import hashlib
+import json
+import re
 
 # Add the emergentintegrations import
 from emergentintegrations.llm.chat import LlmChat, UserMessage, ImageContent
@@ -20,11 +31,75 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# maxPoolSize=20 matches observed peak concurrent LLM requests with headroom; each request
+# holds a connection only for short reads/writes around the multi-second LLM call.
+# minPoolSize keeps a few warm connections so bursts skip the TCP+TLS+auth handshake,
+# and maxIdleTimeMS reaps the rest so idle sockets don't pin server memory.
+client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=int(os.getenv("MONGO_MAX_POOL", "20")),
+    minPoolSize=int(os.getenv("MONGO_MIN_POOL", "2")),
+    maxIdleTimeMS=60000,
+    serverSelectionTimeoutMS=3000,
+    socketTimeoutMS=None
+)
 db = client[os.environ['DB_NAME']]
+# Image bytes live in GridFS; analysis documents only keep a reference
+image_bucket = AsyncIOMotorGridFSBucket(db, bucket_name="images")
+
+# LLM configuration
+EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY')
+LLM_PROVIDER = "openai"
+LLM_MODEL = "gpt-4o"
+# Bump whenever the system prompt or parsing changes so stale cache entries are ignored
+PROMPT_VERSION = "v2"
+
+# Content-addressable analysis cache (opt-in)
+ENABLE_LLM_CACHE = os.environ.get('ENABLE_LLM_CACHE', 'false').lower() in ('1', 'true', 'yes')
+# Backoff (seconds) used while waiting on a concurrent analysis of the same image
+CACHE_POLL_INITIAL_DELAY = 0.05
+CACHE_POLL_MAX_DELAY = 2.0
+CACHE_POLL_TIMEOUT = 30.0
+
+# Upload limits; anything larger or not a recognised image is rejected before the LLM call
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+IMAGE_SIGNATURES = {
+    b'\xff\xd8\xff': "image/jpeg",
+    b'\x89PNG': "image/png",
+    b'GIF8': "image/gif",
+}
+
+# Batch analysis limits
+MAX_BATCH_SIZE = 10
+# Concurrent LLM calls when a batch falls back to one call per image
+BATCH_CONCURRENCY = 4
+
+# Number of times a malformed structured response is sent back to the model for correction
+MAX_PARSE_RETRIES = 2
+
+# Strips a markdown code fence the model sometimes wraps around its JSON output
+CODE_FENCE_RE = re.compile(r'^\s*```(?:json)?\s*(.*?)\s*```\s*$', re.DOTALL)
+
+async def create_indexes():
+    await db.image_analyses.create_index("id", unique=True)
+    # Serves the history sort in index order; the timestamp prefix also covers plain timestamp sorts
+    await db.image_analyses.create_index([("timestamp", -1), ("id", 1), ("filename", 1)])
+    if ENABLE_LLM_CACHE:
+        await db.analysis_cache.create_index(
+            [("key", 1), ("model", 1), ("prompt_ver", 1)], unique=True
+        )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Connect before serving so the first request doesn't pay the handshake; the driver
+    # then keeps minPoolSize connections open in the background
+    await db.command('ping')
+    await create_indexes()
+    yield
+    client.close()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -33,8 +108,9 @@ api_router = APIRouter(prefix="/api")
 class ImageAnalysisResult(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     filename: str
-    image_base64: str
+    image_ref: str
     analysis: str
+    description: str = ""
     objects_detected: List[str] = []
     text_found: str = ""
     emotions: List[str] = []
@@ -46,11 +122,22 @@ class ImageAnalysisCreate(BaseModel):
     filename: str
     image_base64: str
 
+# Structured output the model is asked to return
+class AnalysisFields(BaseModel):
+    description: str
+    objects_detected: List[str] = []
+    text_found: str = ""
+    emotions: List[str] = []
+    scene_description: str = ""
+    confidence: str = ""
+
 class ImageAnalysisResponse(BaseModel):
     id: str
     filename: str
-    image_base64: str
+    image_ref: Optional[str] = None
+    image_base64: Optional[str] = None
     analysis: str
+    description: str = ""
     objects_detected: List[str]
     text_found: str
     emotions: List[str]
@@ -58,131 +145,498 @@ class ImageAnalysisResponse(BaseModel):
     confidence: str
     timestamp: datetime
 
-# Add your routes to the router instead of directly to app
-@api_router.get("/")
-async def root():
-    return {"message": "AI Image Recognition API is running!"}
+BATCH_ANALYSIS_ADAPTER = TypeAdapter(List[AnalysisFields])
 
-@api_router.post("/analyze-image", response_model=ImageAnalysisResponse)
-async def analyze_image(request: ImageAnalysisCreate):
-    try:
-        # Get the API key from environment
-        api_key = os.environ.get('EMERGENT_LLM_KEY')
-        if not api_key:
-            raise HTTPException(status_code=500, detail="AI service not configured")
-        
-        # Create a new LlmChat instance for this analysis
-        session_id = str(uuid.uuid4())
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=session_id,
-            system_message="""You are an expert image analysis AI. Analyze images comprehensively and provide detailed information in a structured format.
+class BatchAnalysisError(BaseModel):
+    index: int
+    filename: str
+    detail: str
+
+# Batch results may be partial; failed images are reported in errors by input index
+class BatchAnalysisResponse(BaseModel):
+    results: List[ImageAnalysisResponse]
+    errors: List[BatchAnalysisError] = []
+
+# Lightweight listing entry; use GET /analysis/{id} for the full document
+class ImageAnalysisSummary(BaseModel):
+    id: str
+    filename: str
+    timestamp: datetime
+    confidence: str = ""
+    scene_description: str = ""
+
+HISTORY_PROJECTION = {"id": 1, "filename": 1, "timestamp": 1, "confidence": 1, "scene_description": 1, "_id": 0}
+
+SYSTEM_PROMPT = f"""You are an expert image analysis AI. Analyze images comprehensively and provide detailed information in a structured format.
 
 For each image, provide:
 1. Overall description of the image
-2. List of objects/items you can identify (comma-separated)
+2. List of objects/items you can identify
 3. Any text you can read in the image
 4. Emotions or mood conveyed (if people are present)
 5. Scene type and context
-6. Your confidence level in the analysis
-
-Format your response as:
-DESCRIPTION: [detailed description]
-OBJECTS: [object1, object2, object3, ...]
-TEXT: [any text found or "None detected"]
-EMOTIONS: [emotion1, emotion2, ...] 
-SCENE: [scene description]
-CONFIDENCE: [High/Medium/Low]"""
-        ).with_model("openai", "gpt-4o")
-        
-        # Create image content from base64
-        image_content = ImageContent(image_base64=request.image_base64)
-        
-        # Create user message with image
-        user_message = UserMessage(
-            text="Please analyze this image comprehensively according to the format specified in your system message.",
-            file_contents=[image_content]
+6. Your confidence level in the analysis (High/Medium/Low)
+
+Respond with a single JSON object and nothing else. Use an empty string or empty list when nothing is detected.
+The JSON object must match this schema:
+{json.dumps(AnalysisFields.model_json_schema())}"""
+
+# Fields produced by the LLM that are safe to reuse across uploads of the same image
+CACHED_FIELDS = ("analysis", "description", "objects_detected", "text_found", "emotions", "scene_description", "confidence")
+
+def compute_cache_key(raw_image: bytes) -> str:
+    return hashlib.sha256(raw_image).hexdigest()
+
+def cache_query(cache_key: str) -> dict:
+    return {"key": cache_key, "model": LLM_MODEL, "prompt_ver": PROMPT_VERSION}
+
+async def claim_cached_analysis(cache_key: str) -> Optional[dict]:
+    # Returns a completed cache entry, or None when this request should run the LLM itself
+    try:
+        result = await db.analysis_cache.update_one(
+            cache_query(cache_key),
+            {"$setOnInsert": {"status": "pending", "provider": LLM_PROVIDER, "started": datetime.utcnow()}},
+            upsert=True
         )
+        if result.upserted_id is not None:
+            return None
+    except DuplicateKeyError:
+        # A concurrent upsert for the same image won the insert
+        pass
+    return await wait_for_cached_analysis(cache_key)
+
+async def wait_for_cached_analysis(cache_key: str) -> Optional[dict]:
+    # Another request is analyzing the same image; poll until it finishes
+    delay = CACHE_POLL_INITIAL_DELAY
+    waited = 0.0
+    while True:
+        entry = await db.analysis_cache.find_one(cache_query(cache_key), {"_id": 0})
+        if entry is None:
+            # The owning request failed and released its claim
+            return None
+        if entry.get("status") != "pending":
+            return entry
+        # Stop waiting on claims left behind by a crashed worker as well as slow ones
+        stale = (datetime.utcnow() - entry["started"]).total_seconds() >= CACHE_POLL_TIMEOUT
+        if stale or waited >= CACHE_POLL_TIMEOUT:
+            logging.warning(f"Timed out waiting for cached analysis {cache_key}")
+            return None
+        await asyncio.sleep(delay)
+        waited += delay
+        delay = min(delay * 2, CACHE_POLL_MAX_DELAY)
+
+async def store_cached_analysis(cache_key: str, analysis_result: ImageAnalysisResult):
+    cache_entry = {field: getattr(analysis_result, field) for field in CACHED_FIELDS}
+    cache_entry.update({
+        "status": "done",
+        "provider": LLM_PROVIDER,
+        "created_at": datetime.utcnow()
+    })
+    await db.analysis_cache.update_one(cache_query(cache_key), {"$set": cache_entry}, upsert=True)
+
+async def release_cached_analysis(cache_key: str):
+    await db.analysis_cache.delete_one({**cache_query(cache_key), "status": "pending"})
+
+def strip_code_fence(analysis: str) -> str:
+    match = CODE_FENCE_RE.match(analysis)
+    return match.group(1) if match else analysis
+
+def parse_analysis_fields(analysis: str) -> AnalysisFields:
+    return AnalysisFields.model_validate_json(strip_code_fence(analysis))
+
+def parse_batch_analysis_fields(analysis: str) -> List[AnalysisFields]:
+    return BATCH_ANALYSIS_ADAPTER.validate_json(strip_code_fence(analysis))
+
+def build_analysis_message(image_base64: str) -> UserMessage:
+    return UserMessage(
+        text="Please analyze this image and respond with the JSON object specified in your system message.",
+        file_contents=[ImageContent(image_base64=image_base64)]
+    )
+
+async def request_analysis(
+    chat: LlmChat,
+    user_message: UserMessage,
+    parse: Callable[[str], Any] = parse_analysis_fields
+) -> Tuple[str, Any]:
+    return await validate_analysis(chat, await chat.send_message(user_message), parse)
+
+async def validate_analysis(
+    chat: LlmChat,
+    analysis: str,
+    parse: Callable[[str], Any] = parse_analysis_fields
+) -> Tuple[str, Any]:
+    for attempt in range(MAX_PARSE_RETRIES + 1):
+        try:
+            return analysis, parse(analysis)
+        except ValidationError as e:
+            if attempt == MAX_PARSE_RETRIES:
+                raise
+            logging.warning(f"Invalid structured analysis (attempt {attempt + 1}): {str(e)}")
+            await asyncio.sleep(1.0 * (attempt + 1))
+            # Feed the validation error back so the model can correct its output
+            analysis = await chat.send_message(UserMessage(
+                text=f"Your previous response did not match the required JSON schema:\n{str(e)}\nRespond again with only the corrected JSON object."
+            ))
+
+def detect_image_type(raw_image: bytes) -> Optional[str]:
+    for signature, content_type in IMAGE_SIGNATURES.items():
+        if raw_image.startswith(signature):
+            return content_type
+    # RIFF is a generic container (WAV, AVI, ...); only WebP is an image
+    if raw_image.startswith(b'RIFF') and raw_image[8:12] == b'WEBP':
+        return "image/webp"
+    return None
+
+def validate_image_bytes(raw_image: bytes):
+    if len(raw_image) > MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image exceeds {MAX_IMAGE_BYTES // (1024 * 1024)} MB limit")
+    if detect_image_type(raw_image) is None:
+        raise HTTPException(status_code=400, detail="Unsupported image format")
+
+async def read_upload(file: UploadFile) -> bytes:
+    # Read at most one byte past the limit so oversized uploads are rejected without buffering them whole
+    raw_image = await file.read(MAX_IMAGE_BYTES + 1)
+    validate_image_bytes(raw_image)
+    return raw_image
+
+def decode_image_base64(image_base64: str) -> bytes:
+    try:
+        raw_image = base64.b64decode(image_base64, validate=True)
+    except binascii.Error:
+        raise HTTPException(status_code=400, detail="Invalid base64 image data")
+    validate_image_bytes(raw_image)
+    return raw_image
+
+async def store_image(filename: str, raw_image: bytes) -> str:
+    content_type = detect_image_type(raw_image) or "application/octet-stream"
+    image_id = await image_bucket.upload_from_stream(
+        filename, raw_image, metadata={"contentType": content_type}
+    )
+    return str(image_id)
+
+async def read_image_base64(analysis: dict) -> Optional[str]:
+    # Documents written before GridFS storage still embed the image
+    if analysis.get("image_base64"):
+        return analysis["image_base64"]
+    if not analysis.get("image_ref"):
+        return None
+    grid_out = await image_bucket.open_download_stream(ObjectId(analysis["image_ref"]))
+    return base64.b64encode(await grid_out.read()).decode('utf-8')
+
+async def delete_image(analysis: dict):
+    if not analysis.get("image_ref"):
+        return
+    try:
+        await image_bucket.delete(ObjectId(analysis["image_ref"]))
+    except NoFile:
+        pass
+
+def create_chat() -> LlmChat:
+    if not EMERGENT_LLM_KEY:
+        raise HTTPException(status_code=500, detail="AI service not configured")
+    # LlmChat keeps the conversation history of its session (the schema-correction
+    # retries rely on it), so an instance can't be shared between requests; only the
+    # immutable configuration is hoisted to module scope.
+    return LlmChat(
+        api_key=EMERGENT_LLM_KEY,
+        session_id=str(uuid.uuid4()),
+        system_message=SYSTEM_PROMPT
+    ).with_model(LLM_PROVIDER, LLM_MODEL)
+
+async def lookup_cached_analysis(filename: str, raw_image: bytes) -> Tuple[Optional[str], Optional[ImageAnalysisResponse]]:
+    # Short-circuit to a previously stored (or concurrently running) analysis of the same image
+    if not ENABLE_LLM_CACHE:
+        return None, None
+    cache_key = compute_cache_key(raw_image)
+    cached = await claim_cached_analysis(cache_key)
+    if not cached:
+        return cache_key, None
+    analysis_result = ImageAnalysisResult(
+        filename=filename,
+        image_ref=await store_image(filename, raw_image),
+        **{field: cached[field] for field in CACHED_FIELDS}
+    )
+    await db.image_analyses.insert_one(analysis_result.dict())
+    return cache_key, ImageAnalysisResponse.model_validate(analysis_result.dict())
+
+async def save_analysis(
+    filename: str,
+    raw_image: bytes,
+    analysis: str,
+    parsed: AnalysisFields,
+    cache_key: Optional[str]
+) -> ImageAnalysisResponse:
+    # Create analysis result
+    analysis_result = ImageAnalysisResult(
+        filename=filename,
+        image_ref=await store_image(filename, raw_image),
+        analysis=analysis,
+        **parsed.dict()
+    )
+    
+    # Store in database
+    await db.image_analyses.insert_one(analysis_result.dict())
+    if cache_key:
+        await store_cached_analysis(cache_key, analysis_result)
+    
+    return ImageAnalysisResponse(**analysis_result.dict())
+
+async def analyze_and_store(filename: str, raw_image: bytes, image_base64: str) -> ImageAnalysisResponse:
+    # Fail before touching storage if the AI service isn't configured
+    chat = create_chat()
+    
+    cache_key, cached = await lookup_cached_analysis(filename, raw_image)
+    if cached:
+        return cached
+    
+    completed = False
+    try:
+        # Get AI analysis as validated structured output
+        analysis, parsed = await request_analysis(chat, build_analysis_message(image_base64))
+        result = await save_analysis(filename, raw_image, analysis, parsed, cache_key)
+        completed = True
+        return result
+    finally:
+        if cache_key and not completed:
+            # Let waiting requests for the same image fall back to their own LLM call
+            await release_cached_analysis(cache_key)
+
+def sse_event(event: str, data: Any) -> str:
+    # JSON-encode the payload so newlines in model output can't break SSE framing
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_analysis(filename: str, raw_image: bytes, image_base64: str) -> AsyncIterator[str]:
+    cache_key = None
+    completed = False
+    try:
+        chat = create_chat()
         
-        # Get AI analysis
-        analysis = await chat.send_message(user_message)
-        
-        # Parse the analysis response
-        objects_detected = []
-        text_found = ""
-        emotions = []
-        scene_description = ""
-        confidence = ""
+        cache_key, cached = await lookup_cached_analysis(filename, raw_image)
+        if cached:
+            completed = True
+            yield sse_event("result", cached.model_dump(mode="json", exclude_none=True))
+            return
         
-        # Simple parsing of the structured response
-        lines = analysis.split('\n')
-        for line in lines:
-            line = line.strip()
-            if line.startswith('OBJECTS:'):
-                objects_list = line.replace('OBJECTS:', '').strip()
-                if objects_list and objects_list != "None detected":
-                    objects_detected = [obj.strip() for obj in objects_list.split(',') if obj.strip()]
-            elif line.startswith('TEXT:'):
-                text_found = line.replace('TEXT:', '').strip()
-            elif line.startswith('EMOTIONS:'):
-                emotions_list = line.replace('EMOTIONS:', '').strip()
-                if emotions_list and emotions_list != "None detected":
-                    emotions = [emotion.strip() for emotion in emotions_list.split(',') if emotion.strip()]
-            elif line.startswith('SCENE:'):
-                scene_description = line.replace('SCENE:', '').strip()
-            elif line.startswith('CONFIDENCE:'):
-                confidence = line.replace('CONFIDENCE:', '').strip()
+        # Forward tokens as they arrive when the SDK supports streaming
+        user_message = build_analysis_message(image_base64)
+        send_message_stream = getattr(chat, "send_message_stream", None)
+        if send_message_stream is None:
+            analysis = await chat.send_message(user_message)
+            yield sse_event("token", analysis)
+        else:
+            chunks = []
+            async for chunk in send_message_stream(user_message):
+                chunks.append(chunk)
+                yield sse_event("token", chunk)
+            analysis = "".join(chunks)
         
-        # Create analysis result
-        analysis_result = ImageAnalysisResult(
-            filename=request.filename,
-            image_base64=request.image_base64,
-            analysis=analysis,
-            objects_detected=objects_detected,
-            text_found=text_found,
-            emotions=emotions,
-            scene_description=scene_description,
-            confidence=confidence
+        analysis, parsed = await validate_analysis(chat, analysis)
+        result = await save_analysis(filename, raw_image, analysis, parsed, cache_key)
+        completed = True
+        yield sse_event("result", result.model_dump(mode="json", exclude_none=True))
+    except Exception as e:
+        logging.error(f"Error streaming image analysis: {str(e)}")
+        detail = e.detail if isinstance(e, HTTPException) else f"Failed to analyze image: {str(e)}"
+        yield sse_event("error", {"detail": detail})
+    finally:
+        # Also runs when the client disconnects and the generator is cancelled or closed
+        if cache_key and not completed:
+            await asyncio.shield(release_cached_analysis(cache_key))
+
+async def analyze_batch_in_one_call(items: List[ImageAnalysisCreate], raw_images: List[bytes]) -> BatchAnalysisResponse:
+    chat = create_chat()
+    
+    # Send every image in a single message so the per-call overhead is paid once
+    user_message = UserMessage(
+        text=f"Please analyze each of these {len(items)} images. Respond with only a JSON array containing one object per image, in input order, each matching the schema specified in your system message.",
+        file_contents=[ImageContent(image_base64=item.image_base64) for item in items]
+    )
+    _, parsed = await request_analysis(chat, user_message, parse_batch_analysis_fields)
+    if len(parsed) != len(items):
+        raise ValueError(f"Expected {len(items)} analyses, got {len(parsed)}")
+    
+    image_refs = await asyncio.gather(*(
+        store_image(item.filename, raw_image) for item, raw_image in zip(items, raw_images)
+    ))
+    results = [
+        ImageAnalysisResult(
+            filename=item.filename,
+            image_ref=image_ref,
+            analysis=fields.model_dump_json(),
+            **fields.dict()
         )
-        
-        # Store in database
-        await db.image_analyses.insert_one(analysis_result.dict())
-        
-        return ImageAnalysisResponse(**analysis_result.dict())
-        
+        for item, image_ref, fields in zip(items, image_refs, parsed)
+    ]
+    
+    # Store in database in a single round trip; unordered so one bad document doesn't abort the rest
+    errors = []
+    try:
+        await db.image_analyses.insert_many([result.dict() for result in results], ordered=False)
+    except BulkWriteError as e:
+        for write_error in e.details["writeErrors"]:
+            index = write_error["index"]
+            errors.append(BatchAnalysisError(index=index, filename=items[index].filename, detail=write_error["errmsg"]))
+            await delete_image({"image_ref": image_refs[index]})
+    
+    failed = {error.index for error in errors}
+    return BatchAnalysisResponse(
+        results=[ImageAnalysisResponse(**result.dict()) for index, result in enumerate(results) if index not in failed],
+        errors=errors
+    )
+
+async def analyze_batch_concurrently(items: List[ImageAnalysisCreate], raw_images: List[bytes]) -> BatchAnalysisResponse:
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    
+    async def analyze_one(item: ImageAnalysisCreate, raw_image: bytes) -> ImageAnalysisResponse:
+        async with semaphore:
+            return await analyze_and_store(item.filename, raw_image, item.image_base64)
+    
+    outcomes = await asyncio.gather(
+        *(analyze_one(item, raw_image) for item, raw_image in zip(items, raw_images)),
+        return_exceptions=True
+    )
+    response = BatchAnalysisResponse(results=[])
+    for index, outcome in enumerate(outcomes):
+        if isinstance(outcome, Exception):
+            logging.error(f"Error analyzing image {items[index].filename}: {str(outcome)}")
+            response.errors.append(BatchAnalysisError(index=index, filename=items[index].filename, detail=str(outcome)))
+        else:
+            response.results.append(outcome)
+    return response
+
+async def analyze_batch(items: List[ImageAnalysisCreate], raw_images: List[bytes]) -> BatchAnalysisResponse:
+    try:
+        return await analyze_batch_in_one_call(items, raw_images)
+    except ValueError as e:
+        # The model couldn't return one valid analysis per image; analyze them individually
+        logging.warning(f"Batch analysis falling back to per-image calls: {str(e)}")
+        return await analyze_batch_concurrently(items, raw_images)
+
+# Add your routes to the router instead of directly to app
+@api_router.get("/")
+async def root():
+    return {"message": "AI Image Recognition API is running!"}
+
+@api_router.post(
+    "/analyze-image",
+    response_model=ImageAnalysisResponse,
+    response_model_exclude_none=True,
+    deprecated=True,
+    description="Deprecated: accepts the image as base64 inside a JSON body. Use /analyze-image-upload instead."
+)
+async def analyze_image(request: ImageAnalysisCreate):
+    raw_image = decode_image_base64(request.image_base64)
+    try:
+        return await analyze_and_store(request.filename, raw_image, request.image_base64)
+    except Exception as e:
+        logging.error(f"Error analyzing image: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to analyze image: {str(e)}")
+
+@api_router.post("/analyze-image-upload", response_model=ImageAnalysisResponse, response_model_exclude_none=True)
+async def analyze_image_upload(file: UploadFile = File(...)):
+    raw_image = await read_upload(file)
+    try:
+        # The LLM SDK needs base64; encode off the event loop since images can be several MB
+        encoded = await asyncio.get_running_loop().run_in_executor(None, base64.b64encode, raw_image)
+        return await analyze_and_store(file.filename or "upload", raw_image, encoded.decode('ascii'))
     except Exception as e:
         logging.error(f"Error analyzing image: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to analyze image: {str(e)}")
 
-@api_router.get("/analysis-history", response_model=List[ImageAnalysisResponse])
+@api_router.post("/analyze-image/stream")
+async def analyze_image_stream(file: UploadFile = File(...)):
+    raw_image = await read_upload(file)
+    encoded = await asyncio.get_running_loop().run_in_executor(None, base64.b64encode, raw_image)
+    return StreamingResponse(
+        stream_analysis(file.filename or "upload", raw_image, encoded.decode('ascii')),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.post("/analyze-images", response_model=BatchAnalysisResponse, response_model_exclude_none=True)
+async def analyze_images(items: List[ImageAnalysisCreate]):
+    if not items or len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Provide between 1 and {MAX_BATCH_SIZE} images")
+    raw_images = [decode_image_base64(item.image_base64) for item in items]
+    try:
+        response = await analyze_batch(items, raw_images)
+    except Exception as e:
+        logging.error(f"Error analyzing images: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to analyze images: {str(e)}")
+    # A batch where nothing succeeded is a failure, not a partial success
+    if not response.results:
+        raise HTTPException(
+            status_code=502,
+            detail={"message": "Failed to analyze images", "errors": [error.dict() for error in response.errors]}
+        )
+    return response
+
+@api_router.get("/analysis-history", response_model=List[ImageAnalysisSummary])
 async def get_analysis_history():
     try:
-        # Get recent analyses (limit to 50 for performance)
-        analyses = await db.image_analyses.find().sort("timestamp", -1).limit(50).to_list(50)
-        return [ImageAnalysisResponse(**analysis) for analysis in analyses]
+        # Get recent analyses (limit to 50 for performance), projecting only the summary fields
+        analyses = await db.image_analyses.find({}, HISTORY_PROJECTION).sort("timestamp", -1).limit(50).to_list(50)
+        return [ImageAnalysisSummary(**analysis) for analysis in analyses]
     except Exception as e:
         logging.error(f"Error fetching analysis history: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch analysis history")
 
-@api_router.get("/analysis/{analysis_id}", response_model=ImageAnalysisResponse)
-async def get_analysis(analysis_id: str):
+@api_router.get("/analysis/{analysis_id}", response_model=ImageAnalysisResponse, response_model_exclude_none=True)
+async def get_analysis(analysis_id: str, include_image: bool = False):
     try:
         analysis = await db.image_analyses.find_one({"id": analysis_id})
         if not analysis:
             raise HTTPException(status_code=404, detail="Analysis not found")
+        if include_image:
+            analysis["image_base64"] = await read_image_base64(analysis)
+        else:
+            analysis.pop("image_base64", None)
         return ImageAnalysisResponse(**analysis)
     except HTTPException:
         raise
+    except (NoFile, InvalidId):
+        raise HTTPException(status_code=404, detail="Image not found")
     except Exception as e:
         logging.error(f"Error fetching analysis: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch analysis")
 
+@api_router.get("/analysis/{analysis_id}/image")
+async def get_analysis_image(analysis_id: str):
+    try:
+        analysis = await db.image_analyses.find_one({"id": analysis_id})
+        if not analysis:
+            raise HTTPException(status_code=404, detail="Analysis not found")
+        if analysis.get("image_base64"):
+            raw_image = base64.b64decode(analysis["image_base64"])
+            return Response(content=raw_image, media_type=detect_image_type(raw_image) or "application/octet-stream")
+        if not analysis.get("image_ref"):
+            raise HTTPException(status_code=404, detail="Image not found")
+        grid_out = await image_bucket.open_download_stream(ObjectId(analysis["image_ref"]))
+        content_type = (grid_out.metadata or {}).get("contentType", "application/octet-stream")
+        
+        async def stream_chunks():
+            while True:
+                chunk = await grid_out.readchunk()
+                if not chunk:
+                    break
+                yield chunk
+        
+        return StreamingResponse(stream_chunks(), media_type=content_type)
+    except HTTPException:
+        raise
+    except (NoFile, InvalidId):
+        raise HTTPException(status_code=404, detail="Image not found")
+    except Exception as e:
+        logging.error(f"Error fetching analysis image: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to fetch analysis image")
+
 @api_router.delete("/analysis/{analysis_id}")
 async def delete_analysis(analysis_id: str):
     try:
-        result = await db.image_analyses.delete_one({"id": analysis_id})
-        if result.deleted_count == 0:
+        analysis = await db.image_analyses.find_one_and_delete({"id": analysis_id})
+        if not analysis:
             raise HTTPException(status_code=404, detail="Analysis not found")
+        await delete_image(analysis)
         return {"message": "Analysis deleted successfully"}
     except HTTPException:
         raise
@@ -193,10 +647,25 @@ async def delete_analysis(analysis_id: str):
 # Include the router in the main app
 app.include_router(api_router)
 
+class SelectiveGZipMiddleware(GZipMiddleware):
+    # Event streams must reach the client per event, and stored images are already compressed
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].endswith(("/stream", "/image")):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+app.add_middleware(SelectiveGZipMiddleware, minimum_size=1024, compresslevel=5)
+
+# Normalize the configured origins once at import time
+CORS_ORIGINS = [origin.strip() for origin in os.environ.get('CORS_ORIGINS', '*').split(',') if origin.strip()]
+ALLOW_ALL_ORIGINS = CORS_ORIGINS == ['*']
+
 app.add_middleware(
     CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+    # Wildcard origins with credentials is invalid per the CORS spec, so only allow credentials for explicit origins
+    allow_credentials=not ALLOW_ALL_ORIGINS,
+    allow_origins=CORS_ORIGINS,
     allow_methods=["*"],
     allow_headers=["*"],
 )
@@ -208,6 +677,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+if __name__ == "__main__":
+    import uvicorn
+    # libuv-based loop and httptools parser cut per-iteration overhead for the I/O-bound endpoints;
+    # "auto" picks uvloop wherever it is installed (requirements skip it on Windows)
+    uvicorn.run(
+        "server:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8000")),
+        loop="auto",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "2"))
+    )
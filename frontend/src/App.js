@@ -6,10 +6,38 @@ import { Upload, Image as ImageIcon, Eye, Trash2, Clock, Sparkles, Brain } from
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Reads the server-sent events from /analyze-image/stream, forwarding tokens as they arrive
+const readAnalysisStream = async (body, onToken) => {
+  const reader = body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const events = buffer.split('\n\n');
+    buffer = events.pop();
+    for (const rawEvent of events) {
+      let event = 'message';
+      let data = '';
+      for (const line of rawEvent.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      }
+      const payload = JSON.parse(data);
+      if (event === 'token') onToken(payload);
+      else if (event === 'result') return payload;
+      else if (event === 'error') throw new Error(payload.detail);
+    }
+  }
+  throw new Error('Analysis stream ended without a result');
+};
+
 const App = () => {
   const [selectedFile, setSelectedFile] = useState(null);
   const [analyzing, setAnalyzing] = useState(false);
   const [analysisResult, setAnalysisResult] = useState(null);
+  const [streamingText, setStreamingText] = useState('');
   const [history, setHistory] = useState([]);
   const [dragOver, setDragOver] = useState(false);
   const [activeTab, setActiveTab] = useState('upload');
@@ -54,32 +82,27 @@ const App = () => {
     }
   };
 
-  const convertFileToBase64 = (file) => {
-    return new Promise((resolve, reject) => {
-      const reader = new FileReader();
-      reader.readAsDataURL(file);
-      reader.onload = () => {
-        // Remove the data:image/jpeg;base64, prefix
-        const base64 = reader.result.split(',')[1];
-        resolve(base64);
-      };
-      reader.onerror = reject;
-    });
-  };
-
   const analyzeImage = async () => {
     if (!selectedFile) return;
 
     setAnalyzing(true);
+    setStreamingText('');
     try {
-      const base64 = await convertFileToBase64(selectedFile);
-      
-      const response = await axios.post(`${API}/analyze-image`, {
-        filename: selectedFile.name,
-        image_base64: base64
+      const formData = new FormData();
+      formData.append('file', selectedFile);
+
+      const response = await fetch(`${API}/analyze-image/stream`, {
+        method: 'POST',
+        body: formData
+      });
+      if (!response.ok || !response.body) {
+        throw new Error(`Request failed with status ${response.status}`);
+      }
+      const result = await readAnalysisStream(response.body, (token) => {
+        setStreamingText((text) => text + token);
       });
 
-      setAnalysisResult(response.data);
+      setAnalysisResult(result);
       setActiveTab('result');
       await fetchHistory(); // Refresh history
     } catch (error) {
@@ -103,9 +126,16 @@ const App = () => {
     }
   };
 
-  const viewAnalysis = (analysis) => {
-    setAnalysisResult(analysis);
-    setActiveTab('result');
+  const viewAnalysis = async (analysis) => {
+    try {
+      // History entries are summaries; fetch the full analysis for the results view
+      const response = await axios.get(`${API}/analysis/${analysis.id}`);
+      setAnalysisResult(response.data);
+      setActiveTab('result');
+    } catch (error) {
+      console.error('Error fetching analysis:', error);
+      alert('Failed to load analysis');
+    }
   };
 
   return (
@@ -236,6 +266,11 @@ const App = () => {
                         Cancel
                       </button>
                     </div>
+                    {analyzing && streamingText && (
+                      <pre className="mt-6 text-left text-sm text-gray-600 bg-gray-50 p-4 rounded-lg whitespace-pre-wrap max-h-64 overflow-y-auto">
+                        {streamingText}
+                      </pre>
+                    )}
                   </div>
                 </div>
               )}
@@ -252,7 +287,7 @@ const App = () => {
               {/* Image */}
               <div>
                 <img
-                  src={`data:image/jpeg;base64,${analysisResult.image_base64}`}
+                  src={`${API}/analysis/${analysisResult.id}/image`}
                   alt={analysisResult.filename}
                   className="w-full rounded-xl shadow-lg"
                 />
@@ -266,7 +301,7 @@ const App = () => {
                 <div>
                   <h3 className="text-lg font-semibold text-gray-900 mb-3">Overall Description</h3>
                   <p className="text-gray-700 leading-relaxed bg-gray-50 p-4 rounded-lg">
-                    {analysisResult.analysis.split('\n').find(line => line.startsWith('DESCRIPTION:'))?.replace('DESCRIPTION:', '').trim() || 'No description available'}
+                    {analysisResult.description || analysisResult.analysis.split('\n').find(line => line.startsWith('DESCRIPTION:'))?.replace('DESCRIPTION:', '').trim() || 'No description available'}
                   </p>
                 </div>
 
@@ -355,7 +390,7 @@ const App = () => {
                 {history.map((analysis) => (
                   <div key={analysis.id} className="border rounded-xl overflow-hidden hover:shadow-lg transition-shadow">
                     <img
-                      src={`data:image/jpeg;base64,${analysis.image_base64}`}
+                      src={`${API}/analysis/${analysis.id}/image`}
                       alt={analysis.filename}
                       className="w-full h-48 object-cover"
                     />